@@ -1,8 +1,12 @@
+from contextlib import asynccontextmanager
 import logging
+import os
 import time
 
+from anyio import to_thread
 from fastapi import Depends, FastAPI
 from fastapi import Request
+from fastapi.responses import ORJSONResponse
 
 from app.dependencies import require_api_key
 from app.routes.health import router as health_router
@@ -16,8 +20,23 @@ from app.routes.segment import router as segment_router
 logger = logging.getLogger("pipeline.api")
 
 
+def _threadpool_size() -> int:
+    return max(1, int(os.getenv("PIPELINE_THREADPOOL_SIZE", "40")))
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    to_thread.current_default_thread_limiter().total_tokens = _threadpool_size()
+    yield
+
+
 def create_app() -> FastAPI:
-    app = FastAPI(title="TGN Python Pipeline", version="0.1.0")
+    app = FastAPI(
+        title="TGN Python Pipeline",
+        version="0.1.0",
+        default_response_class=ORJSONResponse,
+        lifespan=_lifespan,
+    )
 
     @app.middleware("http")
     async def log_requests(request: Request, call_next):
@@ -3,7 +3,7 @@ import os
 from fastapi import Header, HTTPException
 
 
-def require_api_key(x_api_key: str | None = Header(default=None)) -> None:
+async def require_api_key(x_api_key: str | None = Header(default=None)) -> None:
     expected = os.getenv("PIPELINE_API_KEY", "").strip()
     if expected and x_api_key != expected:
         raise HTTPException(status_code=401, detail="Invalid API key")
@@ -6,10 +6,10 @@ router = APIRouter()
 
 
 @router.get("/health")
-def health() -> dict[str, Any]:
+async def health() -> dict[str, Any]:
     return {"status": "ok"}
 
 
 @router.get("/")
-def root() -> dict[str, Any]:
+async def root() -> dict[str, Any]:
     return {"service": "tgn-python-pipeline", "status": "ok"}
@@ -1,24 +1,138 @@
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator
+
+import cv2
+import numpy as np
 import pytesseract
 from fastapi import APIRouter
+from PIL import Image
 
 from app.models import OcrPageRequest, OcrPageResponse, WordBox
 from app.services.http import download_image
 
 router = APIRouter()
+logger = logging.getLogger("pipeline.ocr")
 
+_engine_lock = threading.Lock()
+_engine_pool: queue.LifoQueue | None = None
+_engine_unavailable = False
 
-@router.post("/ocr/page", response_model=OcrPageResponse)
-def ocr_page(payload: OcrPageRequest) -> OcrPageResponse:
-    image_np = download_image(payload.image_url)
+
+@lru_cache(maxsize=1)
+def _ocr_engine_pool_size() -> int:
+    return max(1, int(os.getenv("OCR_ENGINE_POOL_SIZE", "2")))
+
+
+@lru_cache(maxsize=1)
+def _ocr_max_width() -> int:
+    return max(0, int(os.getenv("OCR_MAX_WIDTH", "2400")))
+
+
+def _get_engine_pool() -> queue.LifoQueue | None:
+    global _engine_pool, _engine_unavailable
+    if _engine_pool is not None or _engine_unavailable:
+        return _engine_pool
+
+    with _engine_lock:
+        if _engine_pool is not None or _engine_unavailable:
+            return _engine_pool
+        try:
+            from tesserocr import PyTessBaseAPI
+        except Exception:  # pragma: no cover - optional runtime dependency
+            logger.info("[pipeline/ocr] tesserocr not installed, using pytesseract subprocess")
+            _engine_unavailable = True
+            return None
+
+        pool_size = _ocr_engine_pool_size()
+        pool: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+        try:
+            for _ in range(pool_size):
+                pool.put(PyTessBaseAPI())
+        except Exception as error:  # pragma: no cover - tessdata/language mismatch
+            logger.warning(
+                "[pipeline/ocr] tesserocr failed to initialize, using pytesseract subprocess error=%s",
+                str(error),
+            )
+            _engine_unavailable = True
+            return None
+        logger.info("[pipeline/ocr] tesserocr initialized instances=%s", pool_size)
+        _engine_pool = pool
+        return _engine_pool
+
+
+@contextmanager
+def _borrow_engine(pool: queue.LifoQueue) -> Iterator:
+    # PyTessBaseAPI is not thread-safe; each request holds one instance exclusively.
+    api = pool.get()
+    try:
+        yield api
+    finally:
+        pool.put(api)
+
+
+def _ocr_word_boxes_tesserocr(pool: queue.LifoQueue, image_np: np.ndarray, scale: float) -> list[WordBox]:
+    from tesserocr import RIL, iterate_level
+
+    result: list[WordBox] = []
+    with _borrow_engine(pool) as api:
+        api.SetImage(Image.fromarray(image_np))
+        api.Recognize()
+        iterator = api.GetIterator()
+        if iterator is None:
+            return result
+        for word in iterate_level(iterator, RIL.WORD):
+            text = (word.GetUTF8Text(RIL.WORD) or "").strip()
+            if not text:
+                continue
+            bounds = word.BoundingBox(RIL.WORD)
+            if bounds is None:
+                continue
+            left, top, right, bottom = bounds
+            result.append(WordBox.model_construct(text=text, bbox=[left / scale, top / scale, right / scale, bottom / scale]))
+    return result
+
+
+def _ocr_word_boxes_pytesseract(image_np: np.ndarray, scale: float) -> list[WordBox]:
     data = pytesseract.image_to_data(image_np, output_type=pytesseract.Output.DICT)
+    texts = data.get("text", [])
+    if not texts:
+        return []
+
+    lefts = np.asarray(data["left"], dtype=np.float64)
+    tops = np.asarray(data["top"], dtype=np.float64)
+    rights = lefts + np.asarray(data["width"], dtype=np.float64)
+    bottoms = tops + np.asarray(data["height"], dtype=np.float64)
+    boxes = (np.column_stack((lefts, tops, rights, bottoms)) / scale).tolist()
+
     result: list[WordBox] = []
-    for i, text in enumerate(data.get("text", [])):
+    for text, bbox in zip(texts, boxes):
         text = (text or "").strip()
-        if not text:
-            continue
-        left = float(data["left"][i])
-        top = float(data["top"][i])
-        width = float(data["width"][i])
-        height = float(data["height"][i])
-        result.append(WordBox(text=text, bbox=[left, top, left + width, top + height]))
-    return OcrPageResponse(word_boxes=result)
+        if text:
+            result.append(WordBox.model_construct(text=text, bbox=bbox))
+    return result
+
+
+@router.post("/ocr/page", response_model=OcrPageResponse)
+def ocr_page(payload: OcrPageRequest) -> OcrPageResponse:
+    image_np = cv2.cvtColor(download_image(payload.image_url), cv2.COLOR_RGB2GRAY)
+
+    scale = 1.0
+    max_width = _ocr_max_width()
+    height, width = image_np.shape[:2]
+    if max_width and width > max_width:
+        scale = max_width / width
+        image_np = cv2.resize(
+            image_np,
+            (max_width, max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    pool = _get_engine_pool()
+    if pool is not None:
+        return OcrPageResponse.model_construct(word_boxes=_ocr_word_boxes_tesserocr(pool, image_np, scale))
+    return OcrPageResponse.model_construct(word_boxes=_ocr_word_boxes_pytesseract(image_np, scale))
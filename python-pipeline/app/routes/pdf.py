@@ -1,48 +1,357 @@
+import atexit
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import lru_cache
 from io import BytesIO
+import multiprocessing
 import os
+import shutil
+import tempfile
+import threading
+from typing import Iterator
+import uuid
 
 import fitz
 import requests
 from fastapi import APIRouter, HTTPException
 from PIL import Image
 
-from app.models import PdfAnalyzeRequest, PdfAnalyzeResponse, PdfProcessRequest, PdfProcessResponse, PdfProcessResult
-from app.services.http import download_pdf, request_timeout_seconds
+from app.models import (
+    PdfAnalyzeRequest,
+    PdfAnalyzeResponse,
+    PdfProcessRequest,
+    PdfProcessResponse,
+    PdfProcessResult,
+    UploadTarget,
+)
+from app.services.http import download_to_file, http_session, request_timeout_seconds
 
 router = APIRouter()
 
+_render_pool_lock = threading.Lock()
+_render_pool: ProcessPoolExecutor | None = None
 
+# Only set inside render worker processes: (document_key, open document).
+_worker_document: tuple[str, fitz.Document] | None = None
+
+_pdf_cache_lock = threading.Lock()
+# pdf_url -> (spooled path, conditional request headers), least recently used first.
+_pdf_cache: OrderedDict[str, tuple[str, dict[str, str]]] = OrderedDict()
+# Spooled path -> requests currently reading it; retired paths are removed on last release.
+_pdf_cache_users: dict[str, int] = {}
+_pdf_cache_retired: set[str] = set()
+_pdf_cache_dir: str | None = None
+
+
+@lru_cache(maxsize=1)
 def _pdf_render_dpi() -> int:
     return int(os.getenv("PDF_RENDER_DPI", "150"))
 
 
+@lru_cache(maxsize=1)
 def _pdf_target_width() -> int:
     return int(os.getenv("PDF_TARGET_WIDTH", "1200"))
 
 
+@lru_cache(maxsize=1)
 def _pdf_webp_quality() -> int:
     return int(os.getenv("PDF_WEBP_QUALITY", "85"))
 
 
-def _open_pdf_document(pdf_url: str) -> fitz.Document:
+@lru_cache(maxsize=1)
+def _pdf_webp_method() -> int:
+    return min(6, max(0, int(os.getenv("PDF_WEBP_METHOD", "4"))))
+
+
+@lru_cache(maxsize=1)
+def _pdf_upload_concurrency() -> int:
+    return max(1, int(os.getenv("PDF_UPLOAD_CONCURRENCY", "8")))
+
+
+@lru_cache(maxsize=1)
+def _pdf_render_workers() -> int:
+    default_workers = min(os.cpu_count() or 1, 4)
+    return max(1, int(os.getenv("PDF_RENDER_WORKERS", str(default_workers))))
+
+
+@lru_cache(maxsize=1)
+def _pdf_cache_size() -> int:
+    return max(0, int(os.getenv("PDF_CACHE_SIZE", "4")))
+
+
+def _get_render_pool() -> ProcessPoolExecutor | None:
+    global _render_pool
+    workers = _pdf_render_workers()
+    if workers <= 1:
+        return None
+    if _render_pool is not None:
+        return _render_pool
+
+    with _render_pool_lock:
+        if _render_pool is None:
+            # spawn rather than fork: the server process is already multi-threaded.
+            _render_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _render_pool
+
+
+def _discard_render_pool(pool: ProcessPoolExecutor) -> None:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_page_image(page: fitz.Page, max_zoom: float, max_width: int) -> Image.Image:
+    zoom = min(max_zoom, max_width / page.rect.width) if page.rect.width > 0 else max_zoom
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    image = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples, "raw", "RGB", pix.stride, 1)
+
+    if image.width > max_width:
+        target_height = max(1, int(image.height * (max_width / image.width)))
+        image = image.resize((max_width, target_height), Image.Resampling.LANCZOS)
+    return image
+
+
+def _encode_webp(image: Image.Image, quality: int, method: int) -> tuple[BytesIO, int, int]:
+    output = BytesIO()
+    image.save(output, format="WEBP", quality=quality, method=method)
+    return output, image.width, image.height
+
+
+def _render_page_webp_in_worker(
+    document_key: str,
+    pdf_path: str,
+    page_number: int,
+    max_zoom: float,
+    max_width: int,
+    quality: int,
+    method: int,
+) -> tuple[bytes, int, int]:
+    global _worker_document
+    if _worker_document is None or _worker_document[0] != document_key:
+        if _worker_document is not None:
+            _worker_document[1].close()
+        _worker_document = (document_key, fitz.open(pdf_path, filetype="pdf"))
+
+    page = _worker_document[1].load_page(page_number - 1)
+    output, width, height = _encode_webp(_render_page_image(page, max_zoom, max_width), quality, method)
+    return output.getvalue(), width, height
+
+
+def _encode_and_upload_page(
+    rendered: Image.Image | Future[tuple[bytes, int, int]],
+    quality: int,
+    method: int,
+    upload: UploadTarget,
+    page_number: int,
+) -> tuple[int, int]:
+    webp_body: bytes | memoryview
+    if isinstance(rendered, Future):
+        webp_body, width, height = rendered.result()
+    else:
+        output, width, height = _encode_webp(rendered, quality, method)
+        webp_body = output.getbuffer()
+
     try:
-        pdf_bytes = download_pdf(pdf_url)
+        upload_response = http_session().put(
+            upload.url,
+            headers={"content-type": "image/webp"},
+            data=webp_body,
+            timeout=request_timeout_seconds(),
+        )
+        upload_response.raise_for_status()
     except requests.RequestException as error:
-        raise HTTPException(status_code=502, detail=f"Failed to download PDF: {error}") from error
+        raise HTTPException(
+            status_code=502,
+            detail=f"Upload failed for page {page_number}: {error}",
+        ) from error
+    return width, height
+
+
+def _render_and_upload_pages(
+    document: fitz.Document,
+    pdf_path: str,
+    uploads: list[UploadTarget],
+    start_page: int,
+    end_page: int,
+    zoom: float,
+    max_width: int,
+    quality: int,
+    method: int,
+) -> list[tuple[int, int]]:
+    render_pool = _get_render_pool() if end_page > start_page else None
+    document_key = uuid.uuid4().hex
+    concurrency = _pdf_upload_concurrency()
+    page_tasks: list[Future[tuple[int, int]]] = []
+    pending: deque[Future[tuple[int, int]]] = deque()
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as page_pool:
+            for idx, page_number in enumerate(range(start_page, end_page + 1)):
+                rendered: Image.Image | Future[tuple[bytes, int, int]]
+                if render_pool is not None:
+                    rendered = render_pool.submit(
+                        _render_page_webp_in_worker,
+                        document_key,
+                        pdf_path,
+                        page_number,
+                        zoom,
+                        max_width,
+                        quality,
+                        method,
+                    )
+                else:
+                    # fitz documents are not thread-safe, so pages render on this thread.
+                    rendered = _render_page_image(document.load_page(page_number - 1), zoom, max_width)
+
+                if len(pending) >= concurrency:
+                    pending.popleft().result()
+                task = page_pool.submit(
+                    _encode_and_upload_page,
+                    rendered,
+                    quality,
+                    method,
+                    uploads[idx],
+                    page_number,
+                )
+                page_tasks.append(task)
+                pending.append(task)
+
+            while pending:
+                pending.popleft().result()
+    except BrokenProcessPool as error:
+        # A crashed worker poisons the pool; drop it so the next request gets a fresh one.
+        if render_pool is not None:
+            _discard_render_pool(render_pool)
+        raise HTTPException(status_code=500, detail="PDF render worker crashed") from error
+
+    return [task.result() for task in page_tasks]
+
+
+def _get_pdf_cache_dir() -> str:
+    global _pdf_cache_dir
+    with _pdf_cache_lock:
+        if _pdf_cache_dir is None:
+            _pdf_cache_dir = tempfile.mkdtemp(prefix="pdf-cache-")
+            atexit.register(shutil.rmtree, _pdf_cache_dir, True)
+        return _pdf_cache_dir
+
 
+def _remove_file(path: str) -> None:
     try:
-        return fitz.open(stream=pdf_bytes, filetype="pdf")
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _retire_pdf_locked(path: str) -> None:
+    if path in _pdf_cache_users:
+        _pdf_cache_retired.add(path)
+    else:
+        _remove_file(path)
+
+
+def _pin_cached_pdf(pdf_url: str) -> tuple[str | None, dict[str, str]]:
+    with _pdf_cache_lock:
+        cached = _pdf_cache.get(pdf_url)
+        if cached is None:
+            return None, {}
+        _pdf_cache.move_to_end(pdf_url)
+        path, validators = cached
+        _pdf_cache_users[path] = _pdf_cache_users.get(path, 0) + 1
+        return path, validators
+
+
+def _store_pdf(pdf_url: str, path: str, validators: dict[str, str]) -> None:
+    with _pdf_cache_lock:
+        _pdf_cache_users[path] = 1
+        replaced = _pdf_cache.pop(pdf_url, None)
+        if replaced is not None:
+            _retire_pdf_locked(replaced[0])
+        if not validators or _pdf_cache_size() == 0:
+            _pdf_cache_retired.add(path)
+            return
+
+        _pdf_cache[pdf_url] = (path, validators)
+        while len(_pdf_cache) > _pdf_cache_size():
+            _, (evicted_path, _) = _pdf_cache.popitem(last=False)
+            _retire_pdf_locked(evicted_path)
+
+
+def _release_pdf(path: str) -> None:
+    with _pdf_cache_lock:
+        users = _pdf_cache_users[path] - 1
+        if users > 0:
+            _pdf_cache_users[path] = users
+            return
+        del _pdf_cache_users[path]
+        if path not in _pdf_cache_retired:
+            return
+        _pdf_cache_retired.discard(path)
+    _remove_file(path)
+
+
+def _validator_headers(response: requests.Response) -> dict[str, str]:
+    validators: dict[str, str] = {}
+    if etag := response.headers.get("ETag"):
+        validators["If-None-Match"] = etag
+    if last_modified := response.headers.get("Last-Modified"):
+        validators["If-Modified-Since"] = last_modified
+    return validators
+
+
+def _acquire_pdf(pdf_url: str) -> str:
+    cached_path, validators = _pin_cached_pdf(pdf_url)
+    with tempfile.NamedTemporaryFile(dir=_get_pdf_cache_dir(), suffix=".pdf", delete=False) as pdf_file:
+        try:
+            response = download_to_file(pdf_url, pdf_file, headers=validators)
+        except BaseException as error:
+            _remove_file(pdf_file.name)
+            if cached_path is not None:
+                _release_pdf(cached_path)
+            if isinstance(error, requests.RequestException):
+                raise HTTPException(status_code=502, detail=f"Failed to download PDF: {error}") from error
+            raise
+
+    if cached_path is not None:
+        if response.status_code == 304:
+            _remove_file(pdf_file.name)
+            return cached_path
+        _release_pdf(cached_path)
+    _store_pdf(pdf_url, pdf_file.name, _validator_headers(response))
+    return pdf_file.name
+
+
+@contextmanager
+def _downloaded_pdf(pdf_url: str) -> Iterator[str]:
+    pdf_path = _acquire_pdf(pdf_url)
+    try:
+        yield pdf_path
+    finally:
+        _release_pdf(pdf_path)
+
+
+def _open_pdf_document(pdf_path: str) -> fitz.Document:
+    try:
+        return fitz.open(pdf_path, filetype="pdf")
     except Exception as error:  # pragma: no cover - library-specific parse failures
         raise HTTPException(status_code=400, detail="Could not parse PDF") from error
 
 
 @router.post("/pdf/analyze", response_model=PdfAnalyzeResponse)
 def pdf_analyze(payload: PdfAnalyzeRequest) -> PdfAnalyzeResponse:
-    document = _open_pdf_document(payload.pdf_url)
-    try:
-        return PdfAnalyzeResponse(page_count=document.page_count)
-    finally:
-        document.close()
+    with _downloaded_pdf(payload.pdf_url) as pdf_path:
+        document = _open_pdf_document(pdf_path)
+        try:
+            return PdfAnalyzeResponse(page_count=document.page_count)
+        finally:
+            document.close()
 
 
 @router.post("/pdf/process", response_model=PdfProcessResponse)
@@ -50,73 +359,55 @@ def pdf_process(payload: PdfProcessRequest) -> PdfProcessResponse:
     if not payload.uploads:
         raise HTTPException(status_code=400, detail="uploads must be a non-empty array")
 
-    document = _open_pdf_document(payload.pdf_url)
-    try:
-        page_count = document.page_count
-        if page_count == 0:
-            return PdfProcessResponse(results=[])
+    with _downloaded_pdf(payload.pdf_url) as pdf_path:
+        document = _open_pdf_document(pdf_path)
+        try:
+            page_count = document.page_count
+            if page_count == 0:
+                return PdfProcessResponse(results=[])
 
-        start_page = payload.start_page or 1
-        end_page = payload.end_page or page_count
-
-        if start_page < 1 or end_page < start_page or end_page > page_count:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid page range start_page={start_page} end_page={end_page} for page_count={page_count}",
-            )
-
-        expected_pages = end_page - start_page + 1
-        if len(payload.uploads) < expected_pages:
-            raise HTTPException(
-                status_code=400,
-                detail="uploads must contain at least one URL/key pair per processed page",
-            )
+            start_page = payload.start_page or 1
+            end_page = payload.end_page or page_count
 
-        quality = min(100, max(1, payload.webp_quality or _pdf_webp_quality()))
-        dpi = max(72, payload.render_dpi or _pdf_render_dpi())
-        zoom = dpi / 72.0
-        matrix = fitz.Matrix(zoom, zoom)
-        max_width = max(1, payload.target_width or _pdf_target_width())
-
-        results: list[PdfProcessResult] = []
-
-        for idx, page_number in enumerate(range(start_page, end_page + 1)):
-            page = document.load_page(page_number - 1)
-            pix = page.get_pixmap(matrix=matrix, alpha=False)
-            image = Image.open(BytesIO(pix.tobytes("png"))).convert("RGB")
-
-            if image.width > max_width:
-                target_height = max(1, int(image.height * (max_width / image.width)))
-                image = image.resize((max_width, target_height), Image.Resampling.LANCZOS)
-
-            output = BytesIO()
-            image.save(output, format="WEBP", quality=quality, method=6)
-            webp_bytes = output.getvalue()
-
-            upload = payload.uploads[idx]
-            try:
-                upload_response = requests.put(
-                    upload.url,
-                    headers={"content-type": "image/webp"},
-                    data=webp_bytes,
-                    timeout=request_timeout_seconds(),
+            if start_page < 1 or end_page < start_page or end_page > page_count:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid page range start_page={start_page} end_page={end_page} for page_count={page_count}",
                 )
-                upload_response.raise_for_status()
-            except requests.RequestException as error:
+
+            expected_pages = end_page - start_page + 1
+            if len(payload.uploads) < expected_pages:
                 raise HTTPException(
-                    status_code=502,
-                    detail=f"Upload failed for page {page_number}: {error}",
-                ) from error
+                    status_code=400,
+                    detail="uploads must contain at least one URL/key pair per processed page",
+                )
 
-            results.append(
-                PdfProcessResult(
-                    storage_key=upload.key,
-                    width=image.width,
-                    height=image.height,
-                    page=page_number,
-                ),
-            )
+            quality = min(100, max(1, payload.webp_quality or _pdf_webp_quality()))
+            dpi = max(72, payload.render_dpi or _pdf_render_dpi())
+            zoom = dpi / 72.0
+            max_width = max(1, payload.target_width or _pdf_target_width())
+            method = _pdf_webp_method()
 
-        return PdfProcessResponse(results=results)
-    finally:
-        document.close()
+            page_sizes = _render_and_upload_pages(
+                document,
+                pdf_path,
+                payload.uploads,
+                start_page,
+                end_page,
+                zoom,
+                max_width,
+                quality,
+                method,
+            )
+            results = [
+                PdfProcessResult(
+                    storage_key=payload.uploads[idx].key,
+                    width=width,
+                    height=height,
+                    page=start_page + idx,
+                )
+                for idx, (width, height) in enumerate(page_sizes)
+            ]
+            return PdfProcessResponse(results=results)
+        finally:
+            document.close()
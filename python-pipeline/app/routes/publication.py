@@ -1,36 +1,76 @@
-import json
-import os
 import re
-import logging
-import time
-from typing import Any
 
-import requests
 from fastapi import APIRouter
 
 from app.models import PublicationMetadataPage, PublicationMetadataRequest, PublicationMetadataResponse, WordBox
+from app.services.openrouter import call_openrouter_json
 
 router = APIRouter()
-logger = logging.getLogger("pipeline.ai")
 
-UUID_LIKE_RE = re.compile(
-    r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
-)
 MONTH_DATE_RE = re.compile(
-    r"\b(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|jun(?:e)?|"
+    r"(?=[adfjmnos])\b(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|jun(?:e)?|"
     r"jul(?:y)?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|"
     r"dec(?:ember)?)\b[^.\n]{0,30}\b\d{4}\b",
     re.IGNORECASE,
 )
 NUMERIC_DATE_RE = re.compile(r"\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b")
+WHITESPACE_RE = re.compile(r"\s+")
+FILE_EXTENSION_RE = re.compile(r"\.[^./\\]+$")
+NAME_SEPARATORS_RE = re.compile(r"[\s_\-.]")
+CRYPTIC_COMPACT_NAME_RE = re.compile(r"[0-9a-fA-F]{20,}|\d{8,}")
+ASCII_CHAR_CLASS_TABLE = bytes(
+    ord("U" if chr(code).isupper() else "l" if chr(code).isalpha() else "d" if chr(code).isdigit() else ".")
+    for code in range(256)
+)
+DEFAULT_PUBLICATION_METADATA_MODEL = "qwen/qwen2.5-7b-instruct"
+
+NAME_CANDIDATE_LINES = 24
+DATE_SCAN_LINES = 30
+LLM_DIGEST_LINES = 35
+LEADING_PAGES = 2
+
+PUBLICATION_METADATA_SYSTEM_PROMPT = (
+    "You extract publication metadata from OCR lines.\n"
+    "Return ONLY compact JSON with keys: publication_name, publication_date, confidence.\n"
+    "publication_name must be null when uncertain.\n"
+    "publication_date must be null when uncertain.\n"
+    "confidence is a number from 0 to 1."
+)
+PUBLICATION_METADATA_USER_PROMPT_TEMPLATE = (
+    "Fallback filename: %s\n\n"
+    "OCR lines from first pages:\n"
+    "%s\n\n"
+    "Rules:\n"
+    "- Prefer masthead/publication title, not article titles.\n"
+    "- If title seems unavailable, return null.\n"
+    "- If date is unavailable, return null.\n"
+    "- No extra keys, no prose."
+)
 
 
 def _normalize_spaces(value: str) -> str:
-    return re.sub(r"\s+", " ", value).strip()
+    return WHITESPACE_RE.sub(" ", value).strip()
 
 
 def _strip_file_extension(name: str) -> str:
-    return re.sub(r"\.[^./\\]+$", "", name).strip()
+    return FILE_EXTENSION_RE.sub("", name).strip()
+
+
+def _count_char_classes(value: str) -> tuple[int, int, int]:
+    if value.isascii():
+        classes = value.encode("ascii").translate(ASCII_CHAR_CLASS_TABLE)
+        upper_chars = classes.count(b"U")
+        return upper_chars + classes.count(b"l"), classes.count(b"d"), upper_chars
+
+    alpha_chars = digit_chars = upper_chars = 0
+    for ch in value:
+        if ch.isalpha():
+            alpha_chars += 1
+        elif ch.isdigit():
+            digit_chars += 1
+        if ch.isupper():
+            upper_chars += 1
+    return alpha_chars, digit_chars, upper_chars
 
 
 def _looks_cryptic_name(name: str) -> bool:
@@ -38,18 +78,13 @@ def _looks_cryptic_name(name: str) -> bool:
     if not candidate:
         return True
 
-    compact = re.sub(r"[\s_\-.]", "", candidate)
+    compact = NAME_SEPARATORS_RE.sub("", candidate)
     if not compact:
         return True
-    if UUID_LIKE_RE.match(candidate):
-        return True
-    if re.fullmatch(r"[0-9a-fA-F]{20,}", compact):
-        return True
-    if re.fullmatch(r"\d{8,}", compact):
+    if CRYPTIC_COMPACT_NAME_RE.fullmatch(compact):
         return True
 
-    alpha_count = sum(1 for ch in compact if ch.isalpha())
-    digit_count = sum(1 for ch in compact if ch.isdigit())
+    alpha_count, digit_count, _ = _count_char_classes(compact)
     if alpha_count < 4 and digit_count >= 6:
         return True
 
@@ -67,38 +102,45 @@ def _prettify_fallback_name(name: str | None) -> str | None:
     return cleaned
 
 
-def _group_word_boxes_into_lines(word_boxes: list[WordBox]) -> list[tuple[float, str]]:
-    ordered = [
-        word
-        for word in sorted(word_boxes, key=lambda item: (item.bbox[1], item.bbox[0]))
-        if len(word.bbox) == 4 and _normalize_spaces(word.text)
-    ]
-    if not ordered:
-        return []
-
-    lines: list[dict[str, Any]] = []
-    for word in ordered:
-        y_center = (word.bbox[1] + word.bbox[3]) / 2
-        matched = None
-        for line in lines:
-            if abs(y_center - line["y"]) <= 12:
-                matched = line
-                break
-        if matched is None:
-            matched = {"y": y_center, "count": 0, "words": []}
-            lines.append(matched)
-        matched["count"] += 1
-        matched["y"] = (matched["y"] * (matched["count"] - 1) + y_center) / matched["count"]
-        matched["words"].append(word)
+def _group_word_boxes_into_lines(
+    word_boxes: list[WordBox],
+    max_lines: int | None = None,
+) -> list[tuple[float, str]]:
+    centered = sorted(
+        (
+            ((word.bbox[1] + word.bbox[3]) / 2, word.bbox[0], word)
+            for word in word_boxes
+            if len(word.bbox) == 4 and _normalize_spaces(word.text)
+        ),
+        key=lambda item: (item[0], item[1]),
+    )
 
     grouped_lines: list[tuple[float, str]] = []
-    for line in lines:
-        words = sorted(line["words"], key=lambda item: item.bbox[0])
-        text = _normalize_spaces(" ".join(word.text for word in words))
-        if text:
-            grouped_lines.append((line["y"], text))
-
-    return sorted(grouped_lines, key=lambda item: item[0])
+    line_words: list[WordBox] = []
+    line_sum = 0.0
+    line_y = 0.0
+    for y_center, _, word in centered:
+        if line_words and abs(y_center - line_y) > 12:
+            _append_line(grouped_lines, line_y, line_words)
+            line_words = []
+            line_sum = 0.0
+            # Closed lines never reopen, so callers can stop early.
+            if max_lines is not None and len(grouped_lines) >= max_lines:
+                return grouped_lines
+        line_words.append(word)
+        line_sum += y_center
+        line_y = line_sum / len(line_words)
+    if line_words:
+        _append_line(grouped_lines, line_y, line_words)
+
+    return grouped_lines
+
+
+def _append_line(grouped_lines: list[tuple[float, str]], line_y: float, line_words: list[WordBox]) -> None:
+    words = sorted(line_words, key=lambda item: item.bbox[0])
+    text = _normalize_spaces(" ".join(word.text for word in words))
+    if text:
+        grouped_lines.append((line_y, text))
 
 
 def _score_publication_name_candidate(text: str) -> float:
@@ -110,17 +152,11 @@ def _score_publication_name_candidate(text: str) -> float:
     if len(words) > 12:
         return -1.0
 
-    alpha_chars = sum(1 for ch in value if ch.isalpha())
-    if alpha_chars < 3:
-        return -1.0
-
-    digit_chars = sum(1 for ch in value if ch.isdigit())
-    if digit_chars > alpha_chars:
+    alpha_chars, digit_chars, upper_chars = _count_char_classes(value)
+    if alpha_chars < 3 or digit_chars > alpha_chars:
         return -1.0
 
-    upper_chars = sum(1 for ch in value if ch.isupper())
-    letter_chars = sum(1 for ch in value if ch.isalpha())
-    uppercase_ratio = (upper_chars / letter_chars) if letter_chars else 0.0
+    uppercase_ratio = upper_chars / alpha_chars
 
     lowered = value.lower()
     if lowered.startswith("page ") or lowered.startswith("www.") or "http" in lowered:
@@ -129,40 +165,60 @@ def _score_publication_name_candidate(text: str) -> float:
     score = 1.0
     score += min(1.2, len(words) * 0.12)
     score += uppercase_ratio * 0.7
-    if any(ch in value for ch in ("&", "|")):
+    if "&" in value or "|" in value:
         score += 0.1
     return score
 
 
-def _extract_publication_name_with_score(pages: list[PublicationMetadataPage]) -> tuple[str | None, float]:
-    candidates: list[tuple[float, str]] = []
+def _group_page_lines(
+    pages: list[PublicationMetadataPage],
+) -> list[tuple[PublicationMetadataPage, list[tuple[float, str]]]]:
     sorted_pages = sorted(pages, key=lambda item: item.page_number)
-    for page_index, page in enumerate(sorted_pages):
-        lines = _group_word_boxes_into_lines(page.word_boxes)
+    return [
+        (
+            page,
+            _group_word_boxes_into_lines(
+                page.word_boxes,
+                max(NAME_CANDIDATE_LINES, DATE_SCAN_LINES, LLM_DIGEST_LINES)
+                if page_index < LEADING_PAGES
+                else NAME_CANDIDATE_LINES,
+            ),
+        )
+        for page_index, page in enumerate(sorted_pages)
+    ]
+
+
+def _extract_publication_name_with_score(
+    page_lines: list[tuple[PublicationMetadataPage, list[tuple[float, str]]]],
+) -> tuple[str | None, float]:
+    best_name: str | None = None
+    best_score = 0.0
+    for page_index, (page, lines) in enumerate(page_lines):
         if not lines:
             continue
 
         top_limit = (page.page_height * 0.3) if page.page_height else None
-        for y_pos, line_text in lines[:24]:
+        for y_pos, line_text in lines[:NAME_CANDIDATE_LINES]:
             if top_limit is not None and y_pos > top_limit:
                 continue
             score = _score_publication_name_candidate(line_text)
             if score <= 0:
                 continue
             score += max(0.0, 0.35 - page_index * 0.15)
-            candidates.append((score, _normalize_spaces(line_text).strip(" |-_")))
+            if best_name is None or score > best_score:
+                best_name = _normalize_spaces(line_text).strip(" |-_")
+                best_score = score
 
-    if not candidates:
+    if best_name is None:
         return None, 0.0
-
-    best_score, best_name = max(candidates, key=lambda item: item[0])
     return best_name, best_score
 
 
-def _extract_publication_date_from_pages(pages: list[PublicationMetadataPage]) -> str | None:
-    sorted_pages = sorted(pages, key=lambda item: item.page_number)
-    for page in sorted_pages[:2]:
-        line_text = " ".join(text for _, text in _group_word_boxes_into_lines(page.word_boxes)[:30])
+def _extract_publication_date_from_pages(
+    page_lines: list[tuple[PublicationMetadataPage, list[tuple[float, str]]]],
+) -> str | None:
+    for _, lines in page_lines[:LEADING_PAGES]:
+        line_text = " ".join(text for _, text in lines[:DATE_SCAN_LINES])
         month_match = MONTH_DATE_RE.search(line_text)
         if month_match:
             return _normalize_spaces(month_match.group(0))
@@ -172,144 +228,63 @@ def _extract_publication_date_from_pages(pages: list[PublicationMetadataPage]) -
     return None
 
 
-def _openrouter_timeout_seconds() -> int:
-    return int(os.getenv("OPENROUTER_TIMEOUT_SECONDS", "15"))
-
-
-def _openrouter_config() -> tuple[str | None, str]:
-    api_key = os.getenv("OPENROUTER_API_KEY", "").strip() or None
-    model = os.getenv("OPENROUTER_MODEL", "qwen/qwen2.5-7b-instruct").strip()
-    return api_key, model
-
-
-def _strip_code_fence(value: str) -> str:
-    text = value.strip()
-    if text.startswith("```"):
-        text = re.sub(r"^```[a-zA-Z0-9_-]*\n?", "", text)
-        text = re.sub(r"\n?```$", "", text)
-    return text.strip()
-
-
-def _build_llm_page_digest(pages: list[PublicationMetadataPage]) -> str:
+def _build_llm_page_digest(
+    page_lines: list[tuple[PublicationMetadataPage, list[tuple[float, str]]]],
+) -> str:
     digest_blocks: list[str] = []
-    sorted_pages = sorted(pages, key=lambda item: item.page_number)
-    for page in sorted_pages[:2]:
-        lines = _group_word_boxes_into_lines(page.word_boxes)[:35]
+    for page, lines in page_lines[:LEADING_PAGES]:
         if not lines:
             continue
-        text_lines = [f"- y={int(y)} text={line}" for y, line in lines]
+        text_lines = [f"- y={int(y)} text={line}" for y, line in lines[:LLM_DIGEST_LINES]]
         digest_blocks.append(f"Page {page.page_number}\n" + "\n".join(text_lines))
     return "\n\n".join(digest_blocks)
 
 
 def _extract_publication_metadata_with_llm(
-    pages: list[PublicationMetadataPage],
+    page_lines: list[tuple[PublicationMetadataPage, list[tuple[float, str]]]],
     fallback_name: str | None,
 ) -> tuple[str | None, str | None]:
-    api_key, model = _openrouter_config()
-    if not api_key:
-        logger.info(
-            "[pipeline/ai] operation=extract_publication_metadata skipped reason=missing_openrouter_api_key"
-        )
-        return None, None
-
-    digest = _build_llm_page_digest(pages)
+    digest = _build_llm_page_digest(page_lines)
     if not digest:
         return None, None
 
-    system_prompt = (
-        "You extract publication metadata from OCR lines.\n"
-        "Return ONLY compact JSON with keys: publication_name, publication_date, confidence.\n"
-        "publication_name must be null when uncertain.\n"
-        "publication_date must be null when uncertain.\n"
-        "confidence is a number from 0 to 1."
-    )
-    user_prompt = (
-        f"Fallback filename: {fallback_name or 'null'}\n\n"
-        "OCR lines from first pages:\n"
-        f"{digest}\n\n"
-        "Rules:\n"
-        "- Prefer masthead/publication title, not article titles.\n"
-        "- If title seems unavailable, return null.\n"
-        "- If date is unavailable, return null.\n"
-        "- No extra keys, no prose."
+    user_prompt = PUBLICATION_METADATA_USER_PROMPT_TEMPLATE % (fallback_name or "null", digest)
+    parsed = call_openrouter_json(
+        "extract_publication_metadata",
+        PUBLICATION_METADATA_SYSTEM_PROMPT,
+        user_prompt,
+        default_model=DEFAULT_PUBLICATION_METADATA_MODEL,
     )
+    if not parsed:
+        return None, None
 
-    timeout_seconds = _openrouter_timeout_seconds()
-    started_at = time.perf_counter()
+    confidence = parsed.get("confidence", 0)
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-                "temperature": 0,
-                "response_format": {"type": "json_object"},
-            },
-            timeout=timeout_seconds,
-        )
-        response.raise_for_status()
-        data = response.json()
-        elapsed_ms = (time.perf_counter() - started_at) * 1000
-        usage = data.get("usage", {}) if isinstance(data, dict) else {}
-        prompt_tokens = usage.get("prompt_tokens")
-        completion_tokens = usage.get("completion_tokens")
-        total_tokens = usage.get("total_tokens")
-        logger.info(
-            "[pipeline/ai] operation=extract_publication_metadata model=%s status=%s duration_ms=%.2f prompt_tokens=%s completion_tokens=%s total_tokens=%s",
-            model,
-            response.status_code,
-            elapsed_ms,
-            prompt_tokens,
-            completion_tokens,
-            total_tokens,
-        )
-        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-        parsed = json.loads(_strip_code_fence(content))
-
-        confidence = parsed.get("confidence", 0)
-        try:
-            confidence_num = float(confidence)
-        except (TypeError, ValueError):
-            confidence_num = 0.0
-
-        publication_name = parsed.get("publication_name")
-        publication_date = parsed.get("publication_date")
-        if isinstance(publication_name, str):
-            publication_name = _normalize_spaces(publication_name)
-        else:
-            publication_name = None
-        if isinstance(publication_date, str):
-            publication_date = _normalize_spaces(publication_date)
-        else:
-            publication_date = None
-
-        if confidence_num < 0.6:
-            return None, None
-        return publication_name or None, publication_date or None
-    except Exception as error:
-        elapsed_ms = (time.perf_counter() - started_at) * 1000
-        logger.warning(
-            "[pipeline/ai] operation=extract_publication_metadata model=%s failed duration_ms=%.2f timeout_s=%s error=%s",
-            model,
-            elapsed_ms,
-            timeout_seconds,
-            str(error),
-        )
+        confidence_num = float(confidence)
+    except (TypeError, ValueError):
+        confidence_num = 0.0
+
+    publication_name = parsed.get("publication_name")
+    publication_date = parsed.get("publication_date")
+    if isinstance(publication_name, str):
+        publication_name = _normalize_spaces(publication_name)
+    else:
+        publication_name = None
+    if isinstance(publication_date, str):
+        publication_date = _normalize_spaces(publication_date)
+    else:
+        publication_date = None
+
+    if confidence_num < 0.6:
         return None, None
+    return publication_name or None, publication_date or None
 
 
 @router.post("/publication/metadata", response_model=PublicationMetadataResponse)
 def publication_metadata(payload: PublicationMetadataRequest) -> PublicationMetadataResponse:
-    extracted_name, name_score = _extract_publication_name_with_score(payload.pages)
-    publication_date = _extract_publication_date_from_pages(payload.pages)
+    page_lines = _group_page_lines(payload.pages)
+    extracted_name, name_score = _extract_publication_name_with_score(page_lines)
+    publication_date = _extract_publication_date_from_pages(page_lines)
     should_try_llm = (
         extracted_name is None
         or _looks_cryptic_name(extracted_name)
@@ -319,7 +294,7 @@ def publication_metadata(payload: PublicationMetadataRequest) -> PublicationMeta
     llm_name: str | None = None
     llm_date: str | None = None
     if should_try_llm:
-        llm_name, llm_date = _extract_publication_metadata_with_llm(payload.pages, payload.fallback_name)
+        llm_name, llm_date = _extract_publication_metadata_with_llm(page_lines, payload.fallback_name)
 
     if llm_name and not _looks_cryptic_name(llm_name):
         publication_name = llm_name
@@ -1,14 +1,19 @@
+from concurrent.futures import Future
+import contextlib
+from functools import lru_cache
+import hashlib
 import logging
 import os
 from pathlib import Path
+import queue
 import threading
-import requests
+import time
 
 from fastapi import APIRouter
 from fastapi import HTTPException
 
 from app.models import Segment, SegmentPageRequest, SegmentPageResponse
-from app.services.http import download_image
+from app.services.http import download_image, http_session
 
 router = APIRouter()
 logger = logging.getLogger("pipeline.segment")
@@ -16,8 +21,11 @@ logger = logging.getLogger("pipeline.segment")
 _predictor_lock = threading.Lock()
 _predictor = None
 _predictor_error: RuntimeError | None = None
+_batch_queue_lock = threading.Lock()
+_batch_queue: queue.Queue | None = None
 
 
+@lru_cache(maxsize=1)
 def _segmentor_threshold() -> float:
     raw = os.getenv("SEGMENTOR_CONFIDENCE_THRESHOLD", "0.75").strip()
     try:
@@ -27,6 +35,7 @@ def _segmentor_threshold() -> float:
     return max(0.0, min(1.0, value))
 
 
+@lru_cache(maxsize=1)
 def _detectron_score_threshold() -> float:
     raw = os.getenv("SEGMENTOR_SCORE_THRESH_TEST", "0.25").strip()
     try:
@@ -35,6 +44,7 @@ def _detectron_score_threshold() -> float:
         return 0.25
 
 
+@lru_cache(maxsize=1)
 def _detectron_nms_threshold() -> float:
     raw = os.getenv("SEGMENTOR_NMS_THRESH_TEST", "0.5").strip()
     try:
@@ -43,6 +53,30 @@ def _detectron_nms_threshold() -> float:
         return 0.5
 
 
+@lru_cache(maxsize=1)
+def _segmentor_fp16() -> bool:
+    return os.getenv("SEGMENTOR_FP16", "").strip().lower() in ("1", "true", "yes")
+
+
+@lru_cache(maxsize=1)
+def _segmentor_batch_size() -> int:
+    raw = os.getenv("SEGMENTOR_BATCH_SIZE", "1").strip()
+    try:
+        return max(1, int(raw))
+    except ValueError:
+        return 1
+
+
+@lru_cache(maxsize=1)
+def _segmentor_batch_wait_seconds() -> float:
+    raw = os.getenv("SEGMENTOR_BATCH_WAIT_MS", "20").strip()
+    try:
+        return max(0.0, float(raw)) / 1000
+    except ValueError:
+        return 0.02
+
+
+@lru_cache(maxsize=1)
 def _segmentor_model_weights_path() -> Path:
     model_dir = os.getenv("SEGMENTOR_MODEL_DIR", "").strip()
     if not model_dir:
@@ -53,11 +87,18 @@ def _segmentor_model_weights_path() -> Path:
     return weights
 
 
+@lru_cache(maxsize=1)
 def _segmentor_model_url() -> str | None:
     value = os.getenv("SEGMENTOR_MODEL_URL", "").strip()
     return value or None
 
 
+@lru_cache(maxsize=1)
+def _segmentor_model_sha256() -> str | None:
+    value = os.getenv("SEGMENTOR_MODEL_SHA256", "").strip().lower()
+    return value or None
+
+
 def _segmentor_model_url_marker_path(weights_path: Path) -> Path:
     return weights_path.with_suffix(".source_url.txt")
 
@@ -65,14 +106,22 @@ def _segmentor_model_url_marker_path(weights_path: Path) -> Path:
 def _download_model_weights(weights_path: Path, source_url: str) -> None:
     weights_path.parent.mkdir(parents=True, exist_ok=True)
     temp_path = weights_path.with_suffix(".download.tmp")
+    digest = hashlib.sha256()
     try:
-        with requests.get(source_url, stream=True, timeout=300) as response:
+        with http_session().get(source_url, stream=True, timeout=300) as response:
             response.raise_for_status()
             with temp_path.open("wb") as out:
                 for chunk in response.iter_content(chunk_size=8 * 1024 * 1024):
                     if not chunk:
                         continue
                     out.write(chunk)
+                    digest.update(chunk)
+
+        expected_sha256 = _segmentor_model_sha256()
+        if expected_sha256 and digest.hexdigest() != expected_sha256:
+            raise RuntimeError(
+                f"Downloaded segmentor weights sha256={digest.hexdigest()} does not match SEGMENTOR_MODEL_SHA256"
+            )
         temp_path.replace(weights_path)
     finally:
         if temp_path.exists():
@@ -146,9 +195,10 @@ def _create_predictor():
     device = "cuda" if torch.cuda.is_available() else "cpu"
     cfg.MODEL.DEVICE = device
     logger.info(
-        "[pipeline/segment] detectron initialized weights=%s device=%s score_thresh=%s nms_thresh=%s",
+        "[pipeline/segment] detectron initialized weights=%s device=%s fp16=%s score_thresh=%s nms_thresh=%s",
         str(weights_path),
         device,
+        device == "cuda" and _segmentor_fp16(),
         cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST,
         cfg.MODEL.ROI_HEADS.NMS_THRESH_TEST,
     )
@@ -175,6 +225,81 @@ def _get_predictor():
             raise
 
 
+def _autocast(predictor):
+    if predictor.cfg.MODEL.DEVICE != "cuda" or not _segmentor_fp16():
+        return contextlib.nullcontext()
+
+    import torch
+
+    return torch.autocast("cuda", dtype=torch.float16)
+
+
+def _predict_batch(predictor, images: list) -> list:
+    import torch
+
+    inputs = []
+    for image in images:
+        if predictor.input_format == "RGB":
+            image = image[:, :, ::-1]
+        height, width = image.shape[:2]
+        resized = predictor.aug.get_transform(image).apply_image(image)
+        tensor = torch.as_tensor(resized.astype("float32").transpose(2, 0, 1)).to(predictor.cfg.MODEL.DEVICE)
+        inputs.append({"image": tensor, "height": height, "width": width})
+    with torch.inference_mode(), _autocast(predictor):
+        return predictor.model(inputs)
+
+
+def _run_batches(predictor, pending: queue.Queue) -> None:
+    batch_size = _segmentor_batch_size()
+    wait_seconds = _segmentor_batch_wait_seconds()
+    while True:
+        batch = [pending.get()]
+        deadline = time.monotonic() + wait_seconds
+        while len(batch) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        try:
+            outputs = _predict_batch(predictor, [image for image, _ in batch])
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            continue
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
+
+
+def _get_batch_queue(predictor) -> queue.Queue:
+    global _batch_queue
+    with _batch_queue_lock:
+        if _batch_queue is None:
+            _batch_queue = queue.Queue()
+            threading.Thread(
+                target=_run_batches,
+                args=(predictor, _batch_queue),
+                name="segmentor-batcher",
+                daemon=True,
+            ).start()
+        return _batch_queue
+
+
+def _run_predictor(predictor, image):
+    if _segmentor_batch_size() > 1:
+        future: Future = Future()
+        _get_batch_queue(predictor).put((image, future))
+        return future.result()
+
+    import torch
+
+    with torch.inference_mode(), _autocast(predictor):
+        return predictor(image)
+
+
 @router.post("/segment/page", response_model=SegmentPageResponse)
 def segment_page(payload: SegmentPageRequest) -> SegmentPageResponse:
     try:
@@ -184,16 +309,13 @@ def segment_page(payload: SegmentPageRequest) -> SegmentPageResponse:
         raise HTTPException(status_code=500, detail=str(error)) from error
 
     image = download_image(payload.image_url)
-    model_output = predictor(image)
+    model_output = _run_predictor(predictor, image)
     instances = model_output["instances"].to("cpu")
 
     threshold = _segmentor_threshold()
     confident_predictions = instances[instances.scores > threshold]
-    pred_boxes = [list(map(float, box)) for box in confident_predictions.get("pred_boxes").tensor.tolist()]
-
-    segments: list[Segment] = []
-    for x1, y1, x2, y2 in pred_boxes:
-        segments.append(Segment(bbox=[x1, y1, x2, y2]))
+    pred_boxes = confident_predictions.get("pred_boxes").tensor.float().tolist()
+    segments = [Segment.model_construct(bbox=box) for box in pred_boxes]
 
     skip_reason = None if segments else "no_detections_above_confidence_threshold"
 
@@ -1,23 +1,119 @@
 import os
-from io import BytesIO
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import BinaryIO
 
+import cv2
 import numpy as np
 import requests
-from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
+def _create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=64,
+        max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=(502, 503, 504)),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = _create_session()
+
+_image_cache_lock = threading.Lock()
+# image_url -> (expires_at, decoded read-only RGB image), least recently used first.
+_image_cache: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+_image_cache_bytes = 0
+
+
+def http_session() -> requests.Session:
+    return _session
+
+
+@lru_cache(maxsize=1)
 def request_timeout_seconds() -> int:
     return int(os.getenv("REQUEST_TIMEOUT_SECONDS", "20"))
 
 
+@lru_cache(maxsize=1)
+def _image_cache_max_bytes() -> int:
+    return max(0, int(os.getenv("IMAGE_CACHE_MB", "128"))) * 1024 * 1024
+
+
+@lru_cache(maxsize=1)
+def _image_cache_ttl_seconds() -> float:
+    return max(0.0, float(os.getenv("IMAGE_CACHE_TTL_SECONDS", "300")))
+
+
+def _get_cached_image(image_url: str) -> np.ndarray | None:
+    global _image_cache_bytes
+    with _image_cache_lock:
+        cached = _image_cache.get(image_url)
+        if cached is None:
+            return None
+        expires_at, image = cached
+        if expires_at < time.monotonic():
+            del _image_cache[image_url]
+            _image_cache_bytes -= image.nbytes
+            return None
+        _image_cache.move_to_end(image_url)
+        return image
+
+
+def _cache_image(image_url: str, image: np.ndarray) -> None:
+    global _image_cache_bytes
+    max_bytes = _image_cache_max_bytes()
+    if image.nbytes > max_bytes:
+        return
+
+    with _image_cache_lock:
+        replaced = _image_cache.pop(image_url, None)
+        if replaced is not None:
+            _image_cache_bytes -= replaced[1].nbytes
+        _image_cache[image_url] = (time.monotonic() + _image_cache_ttl_seconds(), image)
+        _image_cache_bytes += image.nbytes
+        while _image_cache_bytes > max_bytes:
+            _, (_, evicted) = _image_cache.popitem(last=False)
+            _image_cache_bytes -= evicted.nbytes
+
+
 def download_image(image_url: str) -> np.ndarray:
-    response = requests.get(image_url, timeout=request_timeout_seconds())
+    # Cached images are shared between requests, so they are returned read-only.
+    cached = _get_cached_image(image_url)
+    if cached is not None:
+        return cached
+
+    response = http_session().get(image_url, timeout=request_timeout_seconds())
     response.raise_for_status()
-    image = Image.open(BytesIO(response.content)).convert("RGB")
-    return np.array(image)
+    encoded = np.frombuffer(response.content, dtype=np.uint8)
+    image = cv2.imdecode(encoded, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise ValueError("Could not decode downloaded image")
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+    image.flags.writeable = False
+    _cache_image(image_url, image)
+    return image
 
 
-def download_pdf(pdf_url: str) -> bytes:
-    response = requests.get(pdf_url, timeout=request_timeout_seconds())
-    response.raise_for_status()
-    return response.content
+def download_to_file(
+    url: str,
+    destination: BinaryIO,
+    headers: dict[str, str] | None = None,
+) -> requests.Response:
+    # A 304 answer to conditional headers leaves destination empty; callers check
+    # the returned status.
+    with http_session().get(url, stream=True, headers=headers, timeout=request_timeout_seconds()) as response:
+        response.raise_for_status()
+        if response.status_code != 304:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                if not chunk:
+                    continue
+                destination.write(chunk)
+    destination.flush()
+    return response
@@ -0,0 +1,204 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import blake2b
+
+import orjson
+import requests
+
+from app.services.http import http_session
+
+logger = logging.getLogger("pipeline.ai")
+
+OPENROUTER_CHAT_COMPLETIONS_URL = "https://openrouter.ai/api/v1/chat/completions"
+RETRYABLE_STATUS_CODES = frozenset((429, 500, 502, 503, 504))
+MAX_RETRY_DELAY_SECONDS = 8.0
+CODE_FENCE_OPEN_RE = re.compile(r"^```[a-zA-Z0-9_-]*\n?")
+CODE_FENCE_CLOSE_RE = re.compile(r"\n?```$")
+
+_completion_cache_lock = threading.Lock()
+# blake2b(model, prompts) -> completion JSON text, least recently used first.
+_completion_cache: OrderedDict[str, str] = OrderedDict()
+
+
+@lru_cache(maxsize=1)
+def _openrouter_timeout_seconds() -> int:
+    return int(os.getenv("OPENROUTER_TIMEOUT_SECONDS", "15"))
+
+
+@lru_cache(maxsize=1)
+def _openrouter_api_key() -> str | None:
+    return os.getenv("OPENROUTER_API_KEY", "").strip() or None
+
+
+@lru_cache(maxsize=1)
+def _openrouter_model() -> str | None:
+    return os.getenv("OPENROUTER_MODEL", "").strip() or None
+
+
+@lru_cache(maxsize=1)
+def _openrouter_max_attempts() -> int:
+    return max(1, int(os.getenv("OPENROUTER_MAX_ATTEMPTS", "3")))
+
+
+@lru_cache(maxsize=1)
+def _openrouter_cache_size() -> int:
+    return max(0, int(os.getenv("OPENROUTER_CACHE_SIZE", "256")))
+
+
+def _completion_cache_key(model: str, system_prompt: str, user_prompt: str) -> str:
+    return blake2b(f"{model}\0{system_prompt}\0{user_prompt}".encode(), digest_size=16).hexdigest()
+
+
+def _get_cached_completion(cache_key: str) -> str | None:
+    with _completion_cache_lock:
+        cached = _completion_cache.get(cache_key)
+        if cached is not None:
+            _completion_cache.move_to_end(cache_key)
+        return cached
+
+
+def _cache_completion(cache_key: str, completion: str) -> None:
+    cache_size = _openrouter_cache_size()
+    if cache_size == 0:
+        return
+    with _completion_cache_lock:
+        _completion_cache[cache_key] = completion
+        _completion_cache.move_to_end(cache_key)
+        while len(_completion_cache) > cache_size:
+            _completion_cache.popitem(last=False)
+
+
+def _strip_code_fence(value: str) -> str:
+    text = value.strip()
+    if text.startswith("```"):
+        text = CODE_FENCE_OPEN_RE.sub("", text)
+        text = CODE_FENCE_CLOSE_RE.sub("", text)
+    return text.strip()
+
+
+def _retry_delay_seconds(response: requests.Response | None, attempt: int) -> float:
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(MAX_RETRY_DELAY_SECONDS, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return min(MAX_RETRY_DELAY_SECONDS, 2**attempt + random.random())
+
+
+def _post(api_key: str, body: bytes, timeout_seconds: int) -> requests.Response:
+    return http_session().post(
+        OPENROUTER_CHAT_COMPLETIONS_URL,
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        },
+        data=body,
+        timeout=timeout_seconds,
+    )
+
+
+def _post_chat_completion(operation: str, api_key: str, body: bytes, timeout_seconds: int) -> requests.Response:
+    for attempt in range(_openrouter_max_attempts() - 1):
+        response: requests.Response | None
+        try:
+            response = _post(api_key, body, timeout_seconds)
+        except (requests.Timeout, requests.ConnectionError):
+            response = None
+        else:
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                response.raise_for_status()
+                return response
+
+        delay_seconds = _retry_delay_seconds(response, attempt)
+        logger.info(
+            "[pipeline/ai] operation=%s retry attempt=%s status=%s delay_s=%.2f",
+            operation,
+            attempt + 1,
+            response.status_code if response is not None else None,
+            delay_seconds,
+        )
+        time.sleep(delay_seconds)
+
+    response = _post(api_key, body, timeout_seconds)
+    response.raise_for_status()
+    return response
+
+
+def call_openrouter_json(
+    operation: str,
+    system_prompt: str,
+    user_prompt: str,
+    default_model: str | None = None,
+) -> dict | None:
+    api_key = _openrouter_api_key()
+    model = _openrouter_model() or default_model
+    if not api_key or not model:
+        logger.info("[pipeline/ai] operation=%s skipped reason=missing_openrouter_config", operation)
+        return None
+
+    cache_key = _completion_cache_key(model, system_prompt, user_prompt)
+    cached = _get_cached_completion(cache_key)
+    if cached is not None:
+        logger.info("[pipeline/ai] operation=%s model=%s cache_hit=true", operation, model)
+        return orjson.loads(cached)
+
+    timeout_seconds = _openrouter_timeout_seconds()
+    started_at = time.perf_counter()
+    try:
+        response = _post_chat_completion(
+            operation,
+            api_key,
+            orjson.dumps(
+                {
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt},
+                    ],
+                    "temperature": 0,
+                    "response_format": {"type": "json_object"},
+                }
+            ),
+            timeout_seconds,
+        )
+        payload = orjson.loads(response.content)
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        usage = payload.get("usage", {}) if isinstance(payload, dict) else {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        total_tokens = usage.get("total_tokens")
+        logger.info(
+            "[pipeline/ai] operation=%s model=%s status=%s duration_ms=%.2f prompt_tokens=%s completion_tokens=%s total_tokens=%s",
+            operation,
+            model,
+            response.status_code,
+            elapsed_ms,
+            prompt_tokens,
+            completion_tokens,
+            total_tokens,
+        )
+        content = payload.get("choices", [{}])[0].get("message", {}).get("content", "")
+        completion = _strip_code_fence(content)
+        parsed = orjson.loads(completion)
+        if not isinstance(parsed, dict):
+            return None
+        _cache_completion(cache_key, completion)
+        return parsed
+    except Exception as error:
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        logger.warning(
+            "[pipeline/ai] operation=%s model=%s failed duration_ms=%.2f timeout_s=%s error=%s",
+            operation,
+            model,
+            elapsed_ms,
+            timeout_seconds,
+            str(error),
+        )
+        return None